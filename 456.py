@@ -2,13 +2,801 @@ import requests
 from bs4 import BeautifulSoup
 import re
 import os
+import io
+import csv
+import gzip
+import json
 import time
 import random
+import socket
+import struct
+import zlib
+import sqlite3
+import tempfile
+import argparse
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime
+from urllib.parse import urljoin
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ManifestWriter:
+    """逐条追加的下载清单（JSONL，可选CSV）"""
+
+    FIELDS = ['id', 'name', 'video_url', 'image_url', 'video_path', 'image_path',
+              'bytes', 'duration', 'status', 'error']
+
+    def __init__(self, path, csv_path=None, fsync_interval=5.0):
+        self.path = path
+        self.csv_path = csv_path
+        self.fsync_interval = fsync_interval
+        self._file = open(path, 'a', encoding='utf-8')
+        self._csv_file = None
+        self._csv_writer = None
+        if csv_path:
+            new_csv = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+            self._csv_file = open(csv_path, 'a', encoding='utf-8', newline='')
+            self._csv_writer = csv.DictWriter(self._csv_file, fieldnames=self.FIELDS)
+            if new_csv:
+                self._csv_writer.writeheader()
+        self._last_sync = time.time()
+
+    def write(self, record):
+        """写入一条记录，按间隔fsync"""
+        row = {field: record.get(field) for field in self.FIELDS}
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if self._csv_writer:
+            self._csv_writer.writerow(row)
+            self._csv_file.flush()
+
+        if time.time() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        if self._csv_file:
+            os.fsync(self._csv_file.fileno())
+        self._last_sync = time.time()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._sync()
+        self._file.close()
+        if self._csv_file:
+            self._csv_file.close()
+
+
+def summarize_manifest(path):
+    """流式统计清单，不整体加载；同一ID重试多次时只按最后一条记录统计
+
+    每个ID的最后状态放在临时SQLite库里，内存占用与ID数量无关。
+    """
+    summary = {
+        'records': 0,
+        'ids': 0,
+        'retries': 0,
+        'status': {},
+        'errors': {},
+        'bytes': 0,
+        'duration': 0.0,
+        'min_id': None,
+        'max_id': None,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'latest.db'))
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("CREATE TABLE latest (id PRIMARY KEY, status TEXT, error TEXT, bytes INTEGER)")
+
+            batch = []
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 中断写入可能留下半行
+                        continue
+
+                    summary['records'] += 1
+                    # 耗时按所有尝试累计
+                    summary['duration'] += record.get('duration') or 0
+
+                    media_id = record.get('id')
+                    batch.append((media_id, record.get('status') or 'unknown',
+                                  record.get('error'), record.get('bytes') or 0))
+                    if len(batch) >= 10000:
+                        conn.executemany("INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?)", batch)
+                        batch = []
+
+                    if isinstance(media_id, int):
+                        if summary['min_id'] is None or media_id < summary['min_id']:
+                            summary['min_id'] = media_id
+                        if summary['max_id'] is None or media_id > summary['max_id']:
+                            summary['max_id'] = media_id
+
+            conn.executemany("INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?)", batch)
+
+            for status, count, size in conn.execute(
+                    "SELECT status, COUNT(*), COALESCE(SUM(bytes), 0) FROM latest GROUP BY status"):
+                summary['status'][status] = count
+                summary['ids'] += count
+                summary['bytes'] += size
+            for error, count in conn.execute(
+                    "SELECT error, COUNT(*) FROM latest WHERE error IS NOT NULL AND error != '' "
+                    "AND status != 'success' GROUP BY error"):
+                summary['errors'][error] = count
+        finally:
+            conn.close()
+
+    summary['retries'] = summary['records'] - summary['ids']
+    return summary
+
+
+def print_manifest_summary(path):
+    """打印清单统计"""
+    summary = summarize_manifest(path)
+
+    print(f"\n{'=' * 60}")
+    print(f"📊 清单统计: {path}")
+    print(f"{'=' * 60}")
+    print(f"📦 ID: {summary['ids']} (记录 {summary['records']}, 重试 {summary['retries']})")
+    if summary['min_id'] is not None:
+        print(f"🔢 ID范围: {summary['min_id']} - {summary['max_id']}")
+    for status, count in sorted(summary['status'].items()):
+        print(f"   {status}: {count}")
+    if summary['errors']:
+        print(f"❌ 错误类型:")
+        for error, count in sorted(summary['errors'].items(), key=lambda x: -x[1]):
+            print(f"   {error}: {count}")
+    print(f"💾 总大小: {summary['bytes'] / (1024 ** 3):.2f} GB")
+    print(f"⏱️  累计耗时: {summary['duration'] / 60:.1f} 分钟")
+    print(f"{'=' * 60}\n")
+
+    return summary
+
+
+def merge_manifests(paths, output):
+    """按顺序流式合并多个分片清单，整体覆盖输出文件（重复合并不会累加）"""
+    count = 0
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for path in paths:
+            if not os.path.exists(path):
+                print(f"⚠️  清单不存在: {path}")
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        out.write(line if line.endswith('\n') else line + '\n')
+                        count += 1
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, output)
+
+    print(f"📄 合并 {len(paths)} 个分片, {count} 条记录 → {output}")
+    return count
+
+
+class LeaseCoordinator:
+    """基于SQLite的ID分片租约协调（多节点共享同一个数据库文件）"""
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    id INTEGER PRIMARY KEY,
+                    start_id INTEGER NOT NULL,
+                    end_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    manifest TEXT
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS budgets (
+                    kind TEXT PRIMARY KEY,
+                    interval REAL NOT NULL,
+                    next_slot REAL NOT NULL
+                )""")
+
+    def _connect(self):
+        # 每次操作单独连接，心跳线程和主线程互不干扰
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        return _Transaction(conn)
+
+    def create_shards(self, start_id, end_id, chunk_size=100, requests_per_minute=10,
+                      media_requests_per_minute=600):
+        """按 start_id → end_id（递减）切分任务，并设置全局请求预算
+
+        requests_per_minute 只限制资源页面；播放列表、HLS分片和文件下载走 media_requests_per_minute。
+        """
+        if requests_per_minute <= 0 or media_requests_per_minute <= 0:
+            raise ValueError("每分钟请求数必须大于0")
+
+        with self._connect() as conn:
+            existing = conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+            if existing:
+                print(f"⚠️  已有 {existing} 个分片，跳过创建")
+            else:
+                current = start_id
+                while current >= end_id:
+                    low = max(end_id, current - chunk_size + 1)
+                    conn.execute("INSERT INTO shards (start_id, end_id) VALUES (?, ?)", (current, low))
+                    current = low - 1
+
+            for kind, rpm in (('page', requests_per_minute), ('media', media_requests_per_minute)):
+                conn.execute("INSERT OR REPLACE INTO budgets (kind, interval, next_slot) VALUES (?, ?, "
+                             "COALESCE((SELECT next_slot FROM budgets WHERE kind = ?), 0))",
+                             (kind, 60.0 / rpm, kind))
+
+        return self.progress()
+
+    def acquire(self, worker_id):
+        """领取一个待处理或租约已过期的分片；已领取 max_attempts 次仍未完成的分片标记为 failed"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                UPDATE shards SET status = 'failed', lease_until = NULL
+                WHERE status = 'leased' AND lease_until < ? AND attempts >= ?""", (now, self.max_attempts))
+            if cursor.rowcount:
+                print(f"🚫 {cursor.rowcount} 个分片已失败 {self.max_attempts} 次，不再分配")
+
+            row = conn.execute("""
+                SELECT id, start_id, end_id, attempts FROM shards
+                WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)
+                ORDER BY start_id DESC LIMIT 1""", (now,)).fetchone()
+            if not row:
+                return None
+            conn.execute("""
+                UPDATE shards SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = ?""", (worker_id, now + self.lease_seconds, row[0]))
+
+        return {'id': row[0], 'start_id': row[1], 'end_id': row[2], 'attempts': row[3] + 1}
+
+    def renew(self, shard_id, worker_id):
+        """续租；租约已被收回时返回False"""
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                UPDATE shards SET lease_until = ?
+                WHERE id = ? AND worker = ? AND status = 'leased' AND lease_until >= ?""",
+                (time.time() + self.lease_seconds, shard_id, worker_id, time.time()))
+            return cursor.rowcount == 1
+
+    def complete(self, shard_id, worker_id, manifest_path):
+        """标记分片完成并登记其清单"""
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                UPDATE shards SET status = 'done', manifest = ?, lease_until = NULL
+                WHERE id = ? AND worker = ? AND status = 'leased'""",
+                (manifest_path, shard_id, worker_id))
+            return cursor.rowcount == 1
+
+    def acquire_request(self, kind='page'):
+        """占用全局请求预算（page 或 media）中的下一个时间槽，必要时等待"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT interval, next_slot FROM budgets WHERE kind = ?", (kind,)).fetchone()
+            if not row:
+                return 0
+            now = time.time()
+            slot = max(now, row[1])
+            conn.execute("UPDATE budgets SET next_slot = ? WHERE kind = ?", (slot + row[0], kind))
+
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def progress(self):
+        """各状态分片数量"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return dict(rows)
+
+    def failed_shards(self):
+        """多次领取仍未完成的分片 (start_id, end_id, attempts)"""
+        with self._connect() as conn:
+            return conn.execute("SELECT start_id, end_id, attempts FROM shards WHERE status = 'failed' "
+                                "ORDER BY start_id DESC").fetchall()
+
+    def manifests(self):
+        """已完成分片的清单路径（按ID递减）"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT manifest FROM shards WHERE status = 'done' "
+                                "ORDER BY start_id DESC").fetchall()
+        return [row[0] for row in rows if row[0]]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE 事务，保证多节点间的领取/预算操作互斥"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.conn.close()
+        return False
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """处理分片期间后台续租"""
+
+    def __init__(self, coordinator, shard_id, worker_id):
+        super().__init__(daemon=True)
+        self.coordinator = coordinator
+        self.shard_id = shard_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        interval = max(1, self.coordinator.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            try:
+                if not self.coordinator.renew(self.shard_id, self.worker_id):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                print(f"\n⚠️  续租失败: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class PageArchive:
+    """压缩页面归档：每个页面一个gzip成员（整体仍是合法的.gz），旁挂 .idx 索引按ID随机读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.lock_path = path + '.lock'
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split('\t')
+                    if len(parts) == 3:
+                        try:
+                            # 同一ID多次抓取时以最后一次为准
+                            self.index[int(parts[0])] = (int(parts[1]), int(parts[2]))
+                        except ValueError:
+                            continue
+        self._file = None
+        self._index_file = None
+        self._lock_file = None
+
+    def append(self, media_id, url, html):
+        """追加一个页面；加文件锁，同一主机上多个进程可共用一个归档"""
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+            self._index_file = open(self.index_path, 'a', encoding='utf-8')
+            self._lock_file = open(self.lock_path, 'a+b')
+
+        header = json.dumps({'id': media_id, 'url': url, 'time': time.time()}, ensure_ascii=False)
+        frame = gzip.compress((header + '\n' + html).encode('utf-8'))
+
+        _lock(self._lock_file)
+        try:
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(frame)
+            self._file.flush()
+            self._index_file.write(f"{media_id}\t{offset}\t{len(frame)}\n")
+            self._index_file.flush()
+        finally:
+            _unlock(self._lock_file)
+        self.index[media_id] = (offset, len(frame))
+
+    def get(self, media_id):
+        """按ID读取页面，返回 (header, html)，不存在时返回None"""
+        entry = self.index.get(media_id)
+        if not entry:
+            return None
+        with open(self.path, 'rb') as f:
+            return read_archive_frame(f, *entry)
+
+    def rebuild_index(self):
+        """逐个扫描gzip成员重建 .idx；末尾不完整的成员（写入中断）会被截掉"""
+        self.close()
+        entries = []
+        broken = 0
+
+        with open(self.lock_path, 'a+b') as lock_file:
+            _lock(lock_file)
+            try:
+                with open(self.path, 'r+b') as f:
+                    member_start = 0
+                    position = 0
+                    decompressor = zlib.decompressobj(31)
+                    head = b''
+
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        data = chunk
+                        while data:
+                            piece = decompressor.decompress(data)
+                            if b'\n' not in head:
+                                head += piece[:4096]
+
+                            if not decompressor.eof:
+                                position += len(data)
+                                break
+
+                            end = position + len(data) - len(decompressor.unused_data)
+                            try:
+                                media_id = json.loads(head.split(b'\n', 1)[0].decode('utf-8'))['id']
+                                entries.append((media_id, member_start, end - member_start))
+                            except (ValueError, KeyError):
+                                broken += 1
+
+                            data = decompressor.unused_data
+                            member_start = position = end
+                            decompressor = zlib.decompressobj(31)
+                            head = b''
+
+                    if position > member_start:
+                        print(f"⚠️  截掉末尾不完整的页面 ({position - member_start} 字节)")
+                        f.truncate(member_start)
+
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for media_id, offset, length in entries:
+                        f.write(f"{media_id}\t{offset}\t{length}\n")
+                os.replace(tmp_path, self.index_path)
+            finally:
+                _unlock(lock_file)
+
+        self.index = {media_id: (offset, length) for media_id, offset, length in entries}
+        print(f"📇 重建索引: {len(entries)} 个页面, {len(self.index)} 个ID"
+              + (f", {broken} 个无法解析" if broken else ""))
+        return len(entries)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._index_file.close()
+            self._lock_file.close()
+            self._file = None
+            self._index_file = None
+            self._lock_file = None
+
+
+def _lock(f):
+    """独占文件锁（阻塞）"""
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_archive_frame(f, offset, length):
+    """从已打开的归档文件读取一帧"""
+    f.seek(offset)
+    payload = gzip.decompress(f.read(length)).decode('utf-8')
+    header, _, html = payload.partition('\n')
+    return json.loads(header), html
+
+
+_reextract_file = None
+_reextract_downloader = None
+
+
+def _reextract_init(archive_path):
+    global _reextract_file, _reextract_downloader
+    _reextract_file = open(archive_path, 'rb')
+    _reextract_downloader = MediaDownloader()
+
+
+def _reextract_one(entry):
+    media_id, offset, length = entry
+    result = {'id': media_id, 'name': None, 'video_url': None, 'image_url': None, 'error': None}
+    try:
+        header, html = read_archive_frame(_reextract_file, offset, length)
+        soup = BeautifulSoup(html, 'html.parser')
+        # 提取器的逐条输出在批量重跑时只是噪音
+        with contextlib.redirect_stdout(io.StringIO()):
+            result['name'] = _reextract_downloader._extract_resource_name(soup)
+            result['video_url'] = _reextract_downloader._extract_video_url(soup, html)
+            result['image_url'] = _reextract_downloader._extract_image_url(soup, html)
+    except Exception as e:
+        result['error'] = type(e).__name__
+    return result
+
+
+def reextract_archive(archive_path, output="reextract.jsonl", workers=None):
+    """用当前提取器在进程池中重跑归档里的全部页面（无网络请求）"""
+    archive = PageArchive(archive_path)
+    entries = sorted(((media_id, offset, length) for media_id, (offset, length) in archive.index.items()),
+                     key=lambda x: x[1])
+
+    print(f"\n🔁 重新提取: {len(entries)} 个页面 ({archive_path})")
+    start_time = time.time()
+    counts = {'name': 0, 'video': 0, 'image': 0, 'none': 0, 'error': 0}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_reextract_init,
+                             initargs=(archive_path,)) as executor, \
+            open(output, 'w', encoding='utf-8') as out:
+        for result in executor.map(_reextract_one, entries, chunksize=64):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            if result['error']:
+                counts['error'] += 1
+                continue
+            if result['name']:
+                counts['name'] += 1
+            if result['video_url']:
+                counts['video'] += 1
+            if result['image_url']:
+                counts['image'] += 1
+            if not result['video_url'] and not result['image_url']:
+                counts['none'] += 1
+
+    elapsed = time.time() - start_time
+    print(f"📋 有名称: {counts['name']}")
+    print(f"🎬 有视频: {counts['video']}")
+    print(f"🖼️  有图片: {counts['image']}")
+    print(f"⚠️  无资源: {counts['none']}")
+    print(f"❌ 出错: {counts['error']}")
+    print(f"⏱️  耗时: {elapsed:.1f}秒 → {output}")
+    return counts
+
+
+class Mp4BoxValidator:
+    """流式MP4顶层box检查：随下载逐块喂入，只解析box头，不回读文件"""
+
+    REQUIRED_BOXES = ('moov', 'mdat')
+    # ftyp 之前允许出现的填充box（QuickTime风格的文件可能以它们开头，甚至没有ftyp）
+    PADDING_BOXES = ('free', 'skip', 'wide')
+
+    def __init__(self):
+        self.position = 0
+        self.next_box = 0
+        self.boxes = []
+        self.to_eof = False
+        self.error = None
+        self._header = b''
+
+    def feed(self, chunk):
+        pos = 0
+        while pos < len(chunk) and self.error is None and not self.to_eof:
+            absolute = self.position + pos
+            if absolute < self.next_box:
+                # box内容直接跳过
+                pos += min(len(chunk) - pos, self.next_box - absolute)
+                continue
+
+            need = 16 if self._header[:4] == b'\x00\x00\x00\x01' else 8
+            taken = chunk[pos:pos + need - len(self._header)]
+            self._header += taken
+            pos += len(taken)
+            if len(self._header) < need:
+                continue
+            if need == 8 and self._header[:4] == b'\x00\x00\x00\x01':
+                # 64位大小，还要再读8字节
+                continue
+
+            self._add_box(self._header)
+            self._header = b''
+
+        self.position += len(chunk)
+
+    def _add_box(self, header):
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_len = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_len = 16
 
+        try:
+            box_type = box_type.decode('ascii')
+        except UnicodeDecodeError:
+            box_type = None
+        if not box_type or not all(32 <= ord(c) < 127 for c in box_type):
+            self.error = f"非法box类型 @ {self.next_box}"
+            return
+
+        if size == 0:
+            # 最后一个box延伸到文件末尾
+            self.to_eof = True
+        elif size < header_len:
+            self.error = f"非法box大小 {box_type}({size}) @ {self.next_box}"
+            return
+
+        self.boxes.append(box_type)
+        self.next_box += size
+
+    def finish(self):
+        """返回 (是否完整, 原因)"""
+        if self.error:
+            return False, self.error
+        if self._header:
+            return False, f"box头被截断 @ {self.next_box}"
+        if not self.to_eof and self.position < self.next_box:
+            box_type = self.boxes[-1] if self.boxes else '?'
+            return False, f"{box_type} 被截断（缺少 {self.next_box - self.position} 字节）"
+        if 'ftyp' in self.boxes:
+            for box_type in self.boxes[:self.boxes.index('ftyp')]:
+                if box_type not in self.PADDING_BOXES:
+                    return False, f"ftyp 之前出现了 {box_type}"
+        for box_type in self.REQUIRED_BOXES:
+            if box_type not in self.boxes:
+                return False, f"缺少 {box_type}"
+        return True, None
+
+
+def validate_mp4_file(path):
+    """只读取box头校验已有MP4文件"""
+    validator = Mp4BoxValidator()
+    total = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        while validator.next_box < total and validator.error is None and not validator.to_eof:
+            f.seek(validator.next_box)
+            validator.position = validator.next_box
+            header = f.read(8)
+            if len(header) == 8 and header[:4] == b'\x00\x00\x00\x01':
+                header += f.read(8)
+            validator.feed(header)
+            if validator._header:
+                break
+
+    validator.position = total
+    return validator.finish()
+
+
+def scan_mp4_tree(root="."):
+    """递归快速校验目录下的所有MP4"""
+    print(f"\n🔍 扫描: {os.path.abspath(root)}")
+    start_time = time.time()
+    checked = 0
+    bad = []
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.lower().endswith('.mp4'):
+                continue
+            path = os.path.join(dirpath, filename)
+            checked += 1
+            try:
+                ok, reason = validate_mp4_file(path)
+            except OSError as e:
+                ok, reason = False, str(e)
+            if not ok:
+                print(f"❌ {path}: {reason}")
+                bad.append((path, reason))
+
+    print(f"\n✅ 正常: {checked - len(bad)}")
+    print(f"❌ 异常: {len(bad)}")
+    print(f"⏱️  耗时: {time.time() - start_time:.1f}秒")
+    return bad
+
+
+class DeadlineExceeded(Exception):
+    """页面在总时限内没有读完"""
+
+
+class LatencyTracker:
+    """最近页面请求耗时的滑动窗口，用于计算分位数"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        """样本不足时返回None"""
+        samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return samples[index]
+
+
+def find_frontier(probe_window, frontier, gap_tolerance=3, min_reach=6, max_step=4096):
+    """倍增探测 frontier+1, +2, +4, ... 找新的最高ID
+
+    probe_window(id) 检查 id 起连续 gap_tolerance 个ID，返回第一个有资源的ID，全空返回None。
+    中间的空段不会让探测停下：只有空窗口的末尾离最高命中点至少 min_reach 时才结束，
+    然后在最高命中点和它上方第一个空探测点之间二分。min_reach 应不小于已观察到的最长空段。
+
+    >>> populated = set(range(164, 400))
+    >>> window = lambda i: next((c for c in range(i, i + 3) if c in populated), None)
+    >>> find_frontier(window, 160)
+    399
+
+    没有新资源时只探测 frontier 之后连续 min_reach 个ID：
+
+    >>> probes = []
+    >>> find_frontier(lambda i: probes.append(i), 399)
+    399
+    >>> probes
+    [400, 401, 403]
+    """
+    last_hit = frontier
+    first_empty = None
+    step = 1
+
+    while step <= max_step:
+        probe = frontier + step
+        step *= 2
+        if probe <= last_hit:
+            continue
+
+        hit = probe_window(probe)
+        if hit is None:
+            if first_empty is None:
+                first_empty = probe
+            if probe + gap_tolerance - 1 - last_hit >= min_reach:
+                break
+        else:
+            last_hit = hit
+            first_empty = None
+
+    if first_empty is None:
+        return last_hit
+
+    low, high = last_hit, first_empty
+    while high - low > 1:
+        mid = (low + high) // 2
+        hit = probe_window(mid)
+        if hit is None:
+            high = mid
+        else:
+            low = hit
+
+    return low
+
+
+def longest_gap(start_id, end_id, empty_ids):
+    """start_id..end_id 内连续空ID的最长长度"""
+    longest = run = 0
+    for media_id in range(start_id, end_id + 1):
+        run = run + 1 if media_id in empty_ids else 0
+        longest = max(longest, run)
+    return longest
 
 class MediaDownloader:
-    def __init__(self, base_url="http://qr.cmpedu.com/CmpBookResource/show_resource.do?id="):
+    def __init__(self, base_url="http://qr.cmpedu.com/CmpBookResource/show_resource.do?id=",
+                 manifest_path=None, manifest_csv_path=None, fsync_interval=5.0, archive_path=None,
+                 hls_window=8, hls_retries=3, hls_max_bandwidth=None,
+                 connect_timeout=5, first_byte_timeout=15, page_timeout=30, media_stall_timeout=30,
+                 hedge=False, hedge_ratio=0.05):
         self.base_url = base_url
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -21,6 +809,30 @@ class MediaDownloader:
         self.success_list = []
         self.failed_list = []
         self.no_media_list = []
+        self.hls_window = hls_window
+        self.hls_retries = hls_retries
+        self.hls_max_bandwidth = hls_max_bandwidth
+        # 分阶段时限：连接 / 首字节 / 页面总时长 / 媒体无数据
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.page_timeout = page_timeout
+        self.media_stall_timeout = media_stall_timeout
+        self.latency = LatencyTracker()
+        self.deadline_misses = 0
+        self.hedge = hedge
+        self.hedge_ratio = hedge_ratio
+        self.page_requests = 0
+        self.hedged_requests = 0
+        self._hedge_executor = None
+        self._page_executor = None
+        self._prefetched = {}
+        # 对外请求前调用，用于跨节点限速：throttle 管页面，media_throttle 管播放列表、分片和文件
+        self.throttle = None
+        self.media_throttle = None
+        self.archive = PageArchive(archive_path) if archive_path else None
+        self.manifest = None
+        if manifest_path:
+            self.manifest = ManifestWriter(manifest_path, manifest_csv_path, fsync_interval)
 
     def _fix_url(self, url):
         """修复转义的URL"""
@@ -117,7 +929,7 @@ class MediaDownloader:
                 print(f"✅ source.src")
                 return url
 
-        pattern1 = r'source\s*:\s*["\']([^"\']+\.mp4)["\']'
+        pattern1 = r'source\s*:\s*["\']([^"\']+\.(?:mp4|m3u8(?:\?[^"\']*)?))["\']'
         matches = re.findall(pattern1, html_text, re.IGNORECASE)
         if matches:
             url = self._fix_url(matches[0])
@@ -125,7 +937,7 @@ class MediaDownloader:
                 print(f"✅ JS source")
                 return url
 
-        pattern2 = r'(?:src|url)\s*:\s*["\']([^"\']+\.mp4)["\']'
+        pattern2 = r'(?:src|url)\s*:\s*["\']([^"\']+\.(?:mp4|m3u8(?:\?[^"\']*)?))["\']'
         matches = re.findall(pattern2, html_text, re.IGNORECASE)
         if matches:
             url = self._fix_url(matches[0])
@@ -133,7 +945,7 @@ class MediaDownloader:
                 print(f"✅ JS src/url")
                 return url
 
-        pattern3 = r'https?:\\?/\\?/[^\s"\'<>]+\.mp4'
+        pattern3 = r'https?:\\?/\\?/[^\s"\'<>]+\.(?:mp4|m3u8(?:\?[^\s"\'<>]*)?)'
         matches = re.findall(pattern3, html_text)
         if matches:
             url = self._fix_url(matches[0])
@@ -141,7 +953,7 @@ class MediaDownloader:
                 print(f"✅ 转义链接")
                 return url
 
-        pattern4 = r'https?://[^\s"\'<>]+\.mp4'
+        pattern4 = r'https?://[^\s"\'<>]+\.(?:mp4|m3u8(?:\?[^\s"\'<>]*)?)'
         matches = re.findall(pattern4, html_text)
         if matches:
             url = self._fix_url(matches[0])
@@ -152,25 +964,46 @@ class MediaDownloader:
         return None
 
     def download_single_media(self, media_id, save_debug=False):
-        """下载单个资源（视频或图片）"""
+        """下载单个资源（视频或图片），并写入清单"""
+        record = {'id': media_id, 'bytes': 0, 'status': 'failed'}
+        start_time = time.time()
+
+        success = self._download_single_media(media_id, record, save_debug)
+        if success:
+            # 视频和图片只成功了一个
+            record['status'] = 'partial' if record.get('error') else 'success'
+
+        record['duration'] = round(time.time() - start_time, 3)
+        if self.manifest:
+            self.manifest.write(record)
+
+        return success
+
+    def _download_single_media(self, media_id, record, save_debug=False):
+        """下载单个资源的实际流程"""
         url = f"{self.base_url}{media_id}"
 
         try:
             print(f"\n{'=' * 60}")
             print(f"[{datetime.now().strftime('%H:%M:%S')}] ID: {media_id}")
 
-            response = self.session.get(url, headers=self.headers, timeout=30)
-            response.encoding = 'utf-8'
+            # watch 探测时已抓取的页面直接复用
+            cached = self._prefetched.pop(media_id, None)
+            status_code, html = cached if cached else self._fetch_page(url)
 
-            if response.status_code != 200:
-                print(f"❌ 页面错误({response.status_code})")
+            if status_code != 200:
+                print(f"❌ 页面错误({status_code})")
+                record['error'] = f"http_{status_code}"
                 return False
 
             if save_debug:
                 with open(f"debug_{media_id}.html", 'w', encoding='utf-8') as f:
-                    f.write(response.text)
+                    f.write(html)
 
-            soup = BeautifulSoup(response.text, 'html.parser')
+            if self.archive:
+                self.archive.append(media_id, url, html)
+
+            soup = BeautifulSoup(html, 'html.parser')
 
             resource_name = self._extract_resource_name(soup)
             if not resource_name:
@@ -179,40 +1012,77 @@ class MediaDownloader:
 
             clean_name = self._clean_filename(resource_name)
 
-            video_url = self._extract_video_url(soup, response.text)
-            image_url = self._extract_image_url(soup, response.text)
+            video_url = self._extract_video_url(soup, html)
+            image_url = self._extract_image_url(soup, html)
+
+            record.update({'name': clean_name, 'video_url': video_url, 'image_url': image_url})
 
             if not video_url and not image_url:
                 print(f"⚠️  无视频/图片")
                 self.no_media_list.append(media_id)
+                record['status'] = 'no_media'
                 return False
 
             download_success = False
 
             if video_url:
                 print(f"🎬 视频: {video_url}")
-                video_path = f"{media_id}_{clean_name}.mp4"
+
+                is_hls = '.m3u8' in video_url.lower()
+                base_path = f"{media_id}_{clean_name}"
 
                 try:
-                    test_file = video_path + '.tmp'
+                    test_file = base_path + '.mp4.tmp'
                     with open(test_file, 'w') as f:
                         pass
                     os.remove(test_file)
                 except:
                     print(f"⚠️  文件名问题，简化")
-                    video_path = f"{media_id}.mp4"
-
+                    base_path = f"{media_id}"
+
+                # HLS：fMP4分片（带EXT-X-MAP）拼接后仍是mp4，TS分片拼接为.ts；先看本地，避免重复请求播放列表
+                candidates = [base_path + '.mp4', base_path + '.ts'] if is_hls else [base_path + '.mp4']
+                video_path = next((path for path in candidates if os.path.exists(path)), None)
+
+                if video_path and video_path.lower().endswith('.mp4'):
+                    # 中断或截断留下的半个文件不能当作已存在
+                    ok, reason = validate_mp4_file(video_path)
+                    if not ok:
+                        # 不删除用户已有的文件，改名留存后重新下载
+                        print(f"⚠️  已有视频校验未通过({reason})，改名为 .bad 后重新下载")
+                        os.replace(video_path, video_path + '.bad')
+                        video_path = None
+
+                hls = None
+                if video_path is None:
+                    video_ext = '.mp4'
+                    if is_hls:
+                        hls = self._resolve_hls(video_url)
+                        if hls and not hls['init']:
+                            video_ext = '.ts'
+                    video_path = base_path + video_ext
+
+                record['video_path'] = video_path
                 if os.path.exists(video_path):
                     size_mb = os.path.getsize(video_path) / (1024 * 1024)
                     print(f"⏭️  视频已存在({size_mb:.1f}MB)")
                     download_success = True
                 else:
                     print(f"📥 保存视频: {video_path}")
-                    if self._download_file(video_url, video_path):
+                    if is_hls:
+                        video_ok = bool(hls) and self._download_hls(hls, video_path)
+                    else:
+                        video_ok = self._download_file(video_url, video_path)
+
+                    if video_ok:
                         print(f"✅ 视频完成")
                         download_success = True
                     else:
                         print(f"❌ 视频失败")
+                        record['error'] = 'video_download'
+
+                if os.path.exists(video_path):
+                    record['bytes'] += os.path.getsize(video_path)
 
             if image_url:
                 print(f"🖼️  图片: {image_url}")
@@ -232,6 +1102,7 @@ class MediaDownloader:
                     print(f"⚠️  文件名问题，简化")
                     image_path = f"{media_id}{img_ext}"
 
+                record['image_path'] = image_path
                 if os.path.exists(image_path):
                     size_kb = os.path.getsize(image_path) / 1024
                     print(f"⏭️  图片已存在({size_kb:.1f}KB)")
@@ -243,6 +1114,10 @@ class MediaDownloader:
                         download_success = True
                     else:
                         print(f"❌ 图片失败")
+                        record['error'] = record.get('error') or 'image_download'
+
+                if os.path.exists(image_path):
+                    record['bytes'] += os.path.getsize(image_path)
 
             if download_success:
                 self.success_list.append({
@@ -257,20 +1132,115 @@ class MediaDownloader:
 
         except Exception as e:
             print(f"❌ 错误: {str(e)}")
+            record['error'] = type(e).__name__
             return False
 
+    def _page_deadline(self):
+        """页面总时限：按实时p99放宽，不超过 page_timeout；连续超时说明网站整体变慢，退回 page_timeout"""
+        p99 = self.latency.percentile(99)
+        if p99 is None or self.deadline_misses >= 3:
+            return self.page_timeout
+        return min(self.page_timeout, max(5.0, p99 * 3))
+
+    def _get_page(self, url, deadline):
+        """读取页面；总时限由等待线程单独计时，不依赖读操作返回（服务器逐字节慢吞吞地发也能截断）"""
+        if self._page_executor is None:
+            self._page_executor = ThreadPoolExecutor(max_workers=8)
+
+        start_time = time.time()
+        holder = {}
+        future = self._page_executor.submit(self._read_page, url, deadline, start_time, holder)
+        try:
+            status_code, content = future.result(timeout=deadline)
+        except (FuturesTimeoutError, DeadlineExceeded):
+            # 关闭连接让后台读取尽快退出，当前任务不再等待
+            holder['expired'] = True
+            response = holder.get('response')
+            if response is not None:
+                response.close()
+            # 超时也计入样本（至少耗时 deadline），否则网站变慢后分位数永远不会跟着变
+            self.latency.add(deadline)
+            self.deadline_misses += 1
+            raise DeadlineExceeded(f"页面超过{deadline:.1f}秒")
+
+        self.deadline_misses = 0
+        self.latency.add(time.time() - start_time)
+        return status_code, content.decode('utf-8', errors='replace')
+
+    def _read_page(self, url, deadline, start_time, holder):
+        response = self.session.get(url, headers=self.headers, stream=True,
+                                    timeout=(self.connect_timeout, self.first_byte_timeout))
+        holder['response'] = response
+        try:
+            if holder.get('expired'):
+                raise DeadlineExceeded(f"页面超过{deadline:.1f}秒")
+            chunks = []
+            for chunk in response.iter_content(chunk_size=16 * 1024):
+                chunks.append(chunk)
+                if time.time() - start_time > deadline:
+                    raise DeadlineExceeded(f"页面超过{deadline:.1f}秒")
+        finally:
+            response.close()
+
+        return response.status_code, b''.join(chunks)
+
+    def _fetch_page(self, url):
+        """获取页面，返回 (状态码, 文本)；开启 hedge 时超过p95再发一次，先到先用"""
+        deadline = self._page_deadline()
+        self.page_requests += 1
+
+        if self.throttle:
+            self.throttle()
+
+        p95 = self.latency.percentile(95) if self.hedge else None
+        if p95 is None:
+            return self._get_page(url, deadline)
+
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=4)
+
+        primary = self._hedge_executor.submit(self._get_page, url, deadline)
+        try:
+            return primary.result(timeout=p95)
+        except FuturesTimeoutError:
+            pass
+
+        futures = [primary]
+        # 对冲请求占总请求的比例有上限，并且同样计入限速
+        if self.hedged_requests < self.hedge_ratio * self.page_requests:
+            self.hedged_requests += 1
+            print(f"🔀 超过p95({p95:.1f}秒)，发送对冲请求")
+            if self.throttle:
+                self.throttle()
+            futures.append(self._hedge_executor.submit(self._get_page, url, deadline))
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
     def _download_file(self, url, file_path, is_image=False):
-        """下载文件"""
+        """下载文件：先写 .part，完整性检查通过后再改名，中断不会留下看似完整的文件"""
+        part_path = file_path + '.part'
         try:
-            response = self.session.get(url, headers=self.headers, stream=True, timeout=60)
+            if self.media_throttle:
+                self.media_throttle()
+            response = self.session.get(url, headers=self.headers, stream=True,
+                                        timeout=(self.connect_timeout, self.media_stall_timeout))
 
             if response.status_code != 200:
                 print(f"❌ 下载失败({response.status_code})")
                 return False
 
             total_size = int(response.headers.get('content-length', 0))
+            validator = None
+            if not is_image and file_path.lower().endswith('.mp4'):
+                validator = Mp4BoxValidator()
 
-            with open(file_path, 'wb') as f:
+            with open(part_path, 'wb') as f:
                 if is_image and total_size < 10 * 1024 * 1024:
                     f.write(response.content)
                     print(f"💾 {total_size / 1024:.1f}KB")
@@ -283,6 +1253,8 @@ class MediaDownloader:
                         if chunk:
                             f.write(chunk)
                             downloaded += len(chunk)
+                            if validator:
+                                validator.feed(chunk)
 
                             current = time.time()
                             if current - last_print >= 0.5:
@@ -301,19 +1273,182 @@ class MediaDownloader:
                         print()
 
             if total_size > 0:
-                actual = os.path.getsize(file_path)
+                actual = os.path.getsize(part_path)
                 if actual < total_size * 0.95:
                     print(f"⚠️  文件可能不完整")
                     return False
 
+            if validator:
+                ok, reason = validator.finish()
+                if not ok:
+                    print(f"⚠️  视频结构不完整: {reason}")
+                    return False
+
+            os.replace(part_path, file_path)
             return True
 
         except Exception as e:
             print(f"\n❌ 下载失败: {str(e)}")
-            if os.path.exists(file_path):
-                os.remove(file_path)
             return False
 
+        finally:
+            # 失败或被中断（包括Ctrl-C）时清理半成品
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def _resolve_hls(self, url, depth=0):
+        """解析m3u8，主列表按码率选一个子列表，返回分片信息"""
+        try:
+            if self.media_throttle:
+                self.media_throttle()
+            response = self.session.get(url, headers=self.headers,
+                                        timeout=(self.connect_timeout, self.first_byte_timeout))
+            response.encoding = 'utf-8'
+            if response.status_code != 200:
+                print(f"❌ 播放列表错误({response.status_code})")
+                return None
+            text = response.text
+        except Exception as e:
+            print(f"❌ 播放列表失败: {str(e)}")
+            return None
+
+        if '#EXTM3U' not in text:
+            print(f"⚠️  不是m3u8播放列表")
+            return None
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+        if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+            if depth > 0:
+                print(f"⚠️  播放列表嵌套过深")
+                return None
+
+            variants = []
+            for i, line in enumerate(lines):
+                if line.startswith('#EXT-X-STREAM-INF') and i + 1 < len(lines) and not lines[i + 1].startswith('#'):
+                    match = re.search(r'BANDWIDTH=(\d+)', line)
+                    bandwidth = int(match.group(1)) if match else 0
+                    variants.append((bandwidth, urljoin(url, lines[i + 1])))
+
+            if not variants:
+                print(f"⚠️  主播放列表没有子列表")
+                return None
+
+            variants.sort()
+            chosen = variants[-1]
+            if self.hls_max_bandwidth:
+                allowed = [v for v in variants if v[0] <= self.hls_max_bandwidth]
+                chosen = allowed[-1] if allowed else variants[0]
+            print(f"📶 HLS码率: {chosen[0] / 1000:.0f}kbps ({len(variants)}个可选)")
+            return self._resolve_hls(chosen[1], depth + 1)
+
+        init_url = None
+        segments = []
+        for line in lines:
+            if line.startswith('#EXT-X-KEY'):
+                method = re.search(r'METHOD=([A-Z0-9-]+)', line)
+                if method and method.group(1) != 'NONE':
+                    print(f"⚠️  不支持加密HLS({method.group(1)})")
+                    return None
+            elif line.startswith('#EXT-X-BYTERANGE'):
+                print(f"⚠️  不支持BYTERANGE分片")
+                return None
+            elif line.startswith('#EXT-X-MAP'):
+                match = re.search(r'URI="([^"]+)"', line)
+                if match:
+                    init_url = urljoin(url, match.group(1))
+            elif not line.startswith('#'):
+                segments.append(urljoin(url, line))
+
+        if not segments:
+            print(f"⚠️  播放列表没有分片")
+            return None
+
+        print(f"🧩 HLS分片: {len(segments)}")
+        return {'url': url, 'init': init_url, 'segments': segments}
+
+    def _fetch_segment(self, url):
+        """下载单个分片，失败重试；每次尝试都计入请求预算"""
+        for attempt in range(self.hls_retries):
+            try:
+                if self.media_throttle:
+                    self.media_throttle()
+                response = self.session.get(url, headers=self.headers,
+                                            timeout=(self.connect_timeout, self.media_stall_timeout))
+                if response.status_code == 200:
+                    return response.content
+            except Exception:
+                pass
+            time.sleep(1 + attempt)
+        return None
+
+    def _download_hls(self, playlist, file_path):
+        """并发下载HLS分片，按顺序流式拼接到 .part；内存中最多保留 hls_window 个分片，全部分片到齐才改名"""
+        part_path = file_path + '.part'
+        urls = playlist['segments']
+        if playlist['init']:
+            urls = [playlist['init']] + urls
+        validator = Mp4BoxValidator() if playlist['init'] else None
+
+        executor = ThreadPoolExecutor(max_workers=self.hls_window)
+        try:
+            with open(part_path, 'wb') as f:
+                futures = {}
+                next_submit = 0
+                downloaded = 0
+                start_time = time.time()
+                last_print = 0
+                failed = False
+
+                for i in range(len(urls)):
+                    while next_submit < len(urls) and next_submit < i + self.hls_window:
+                        futures[next_submit] = executor.submit(self._fetch_segment, urls[next_submit])
+                        next_submit += 1
+
+                    data = futures.pop(i).result()
+                    if data is None:
+                        print(f"\n❌ 分片失败({i + 1}/{len(urls)}): {urls[i]}")
+                        failed = True
+                        break
+
+                    f.write(data)
+                    downloaded += len(data)
+                    if validator:
+                        validator.feed(data)
+
+                    current = time.time()
+                    if current - last_print >= 0.5 or i == len(urls) - 1:
+                        percent = (i + 1) / len(urls) * 100
+                        elapsed = current - start_time
+                        speed = (downloaded / elapsed / 1024) if elapsed > 0 else 0
+                        print(f"\r⬇️  {percent:.1f}% ({i + 1}/{len(urls)}段 {downloaded / (1024 * 1024):.1f}MB) "
+                              f"{speed:.0f}KB/s", end='')
+                        last_print = current
+
+                if not failed:
+                    print()
+
+            if failed:
+                return False
+
+            if validator:
+                ok, reason = validator.finish()
+                if not ok:
+                    print(f"⚠️  视频结构不完整: {reason}")
+                    return False
+
+            os.replace(part_path, file_path)
+            return True
+
+        except Exception as e:
+            print(f"\n❌ 下载失败: {str(e)}")
+            return False
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
     def batch_download(self, start_id, end_id, delay_range=(3, 10)):
         """批量下载 - 随机延迟"""
         print(f"\n{'🚀 ' * 30}")
@@ -341,6 +1476,187 @@ class MediaDownloader:
         elapsed = time.time() - start_time
         self._print_summary(elapsed)
 
+    def run_worker(self, coordinator, worker_id=None, manifest_dir="shards", delay_range=(0, 0)):
+        """分片工作节点：领取租约 → 下载 → 提交分片清单"""
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        os.makedirs(manifest_dir, exist_ok=True)
+
+        # 全局请求预算由协调库统一分配
+        self.throttle = lambda: coordinator.acquire_request('page')
+        self.media_throttle = lambda: coordinator.acquire_request('media')
+        own_manifest = self.manifest
+
+        print(f"\n👷 工作节点: {worker_id}")
+        start_time = time.time()
+
+        while True:
+            shard = coordinator.acquire(worker_id)
+            if not shard:
+                progress = coordinator.progress()
+                if not progress.get('pending') and not progress.get('leased'):
+                    break
+                # 其余分片正被其他节点处理，等待租约过期后可能重新分配
+                wait = min(30, coordinator.lease_seconds)
+                print(f"⏳ 暂无可领取分片，{wait}秒后重试...")
+                time.sleep(wait)
+                continue
+
+            print(f"\n📦 分片 #{shard['id']}: {shard['start_id']} → {shard['end_id']} (第{shard['attempts']}次)")
+
+            manifest_path = os.path.join(manifest_dir, f"manifest_shard_{shard['id']}_{worker_id}.jsonl")
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            self.manifest = ManifestWriter(manifest_path)
+
+            heartbeat = _LeaseHeartbeat(coordinator, shard['id'], worker_id)
+            heartbeat.start()
+
+            try:
+                current_id = shard['start_id']
+                while current_id >= shard['end_id']:
+                    if heartbeat.lost:
+                        break
+
+                    success = self.download_single_media(current_id)
+                    if not success and current_id not in self.no_media_list:
+                        self.failed_list.append(current_id)
+
+                    current_id -= 1
+
+                    if current_id >= shard['end_id'] and delay_range[1] > 0:
+                        time.sleep(random.uniform(delay_range[0], delay_range[1]))
+            finally:
+                heartbeat.stop()
+                self.manifest.close()
+
+            if heartbeat.lost or not coordinator.complete(shard['id'], worker_id, manifest_path):
+                print(f"⚠️  分片 #{shard['id']} 租约已失效，结果作废")
+            else:
+                print(f"✅ 分片 #{shard['id']} 完成")
+
+        self.manifest = own_manifest
+        self.throttle = None
+        self.media_throttle = None
+        self._print_summary(time.time() - start_time)
+
+    def _probe(self, media_id, delay_range=(1, 3)):
+        """探测ID是否有视频/图片，页面缓存给后续下载复用"""
+        if media_id not in self._prefetched:
+            time.sleep(random.uniform(delay_range[0], delay_range[1]))
+            self._prefetched[media_id] = self._fetch_page(f"{self.base_url}{media_id}")
+
+        status_code, html = self._prefetched[media_id]
+        found = False
+        if status_code == 200:
+            soup = BeautifulSoup(html, 'html.parser')
+            with contextlib.redirect_stdout(io.StringIO()):
+                found = bool(self._extract_video_url(soup, html) or self._extract_image_url(soup, html))
+
+        print(f"🔎 ID {media_id}: {'有资源' if found else '空'}")
+        return found
+
+    def _probe_window(self, media_id, gap_tolerance):
+        """连续 gap_tolerance 个ID内第一个有资源的ID，全空返回None"""
+        for candidate in range(media_id, media_id + gap_tolerance):
+            if self._probe(candidate):
+                return candidate
+        return None
+
+    def _find_frontier(self, frontier, gap_tolerance=3, min_reach=6, max_step=4096):
+        """从已知最高ID向后倍增探测，再二分定位新的最高ID"""
+        return find_frontier(lambda media_id: self._probe_window(media_id, gap_tolerance),
+                             frontier, gap_tolerance, min_reach, max_step)
+
+    def watch(self, state_path="watch_state.json", start_id=None, min_interval=60, max_interval=3600,
+              gap_tolerance=3, delay_range=(3, 10), max_retries=5):
+        """持续监视新发布的ID：记住最高有资源ID，定期向后探测并只下载新增部分；失败的ID记入状态文件，之后每轮重试"""
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+
+        frontier = state.get('frontier', start_id)
+        if frontier is None:
+            print(f"❌ 没有状态文件，需要指定起始ID")
+            return
+
+        interval = min(max_interval, max(min_interval, state.get('interval', min_interval)))
+        # 见过的最长连续空ID段，空闲时的探测范围随之调整
+        max_gap = state.get('max_gap', 0)
+        # 连续没有新资源的轮数；每3轮把探测范围翻倍一次，防止卡在比已知更长的空段前
+        idle_cycles = state.get('idle_cycles', 0)
+        # {ID: 已尝试次数}
+        failed = {int(media_id): attempts for media_id, attempts in state.get('failed', {}).items()}
+        print(f"\n👀 监视模式: 当前最高ID {frontier}, 检查间隔 {min_interval}-{max_interval}秒")
+
+        try:
+            while True:
+                print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 探测新ID...")
+                probe_failed = False
+                try:
+                    min_reach = max(2 * gap_tolerance, max_gap + 1) * 2 ** min(idle_cycles // 3, 4)
+                    new_frontier = self._find_frontier(frontier, gap_tolerance, min_reach)
+                except Exception as e:
+                    # 网络问题不代表没有新资源，下一轮按原间隔重试
+                    print(f"❌ 探测失败: {str(e)}")
+                    probe_failed = True
+                    new_frontier = frontier
+
+                if failed:
+                    self.failed_list = sorted(failed, reverse=True)
+                    self.retry_failed(delay_range)
+                    # 重试时变成无资源的ID不再算失败
+                    still_failed = set(self.failed_list) - set(self.no_media_list)
+                    for media_id in list(failed):
+                        if media_id not in still_failed:
+                            del failed[media_id]
+                        else:
+                            failed[media_id] += 1
+                            if failed[media_id] >= max_retries:
+                                print(f"🚫 ID {media_id} 已失败 {failed[media_id]} 次，放弃")
+                                del failed[media_id]
+                    self.failed_list = []
+
+                if new_frontier > frontier:
+                    print(f"🆕 新资源: {frontier + 1} → {new_frontier}")
+                    self.batch_download(new_frontier, frontier + 1, delay_range)
+                    for media_id in self.failed_list:
+                        failed[media_id] = 1
+                    max_gap = max(max_gap, longest_gap(frontier + 1, new_frontier, set(self.no_media_list)))
+                    frontier = new_frontier
+                    idle_cycles = 0
+                    # 有更新时加快检查，没有时逐步放慢
+                    interval = max(min_interval, interval / 2)
+                elif probe_failed:
+                    print(f"⚠️  本轮探测不完整，保持检查间隔")
+                else:
+                    print(f"😴 没有新资源")
+                    idle_cycles += 1
+                    interval = min(max_interval, interval * 1.5)
+
+                # 长时间运行，结果已写入清单，每轮清空内存中的列表
+                self.success_list = []
+                self.no_media_list = []
+                self.failed_list = []
+                self._prefetched = {}
+                self._save_watch_state(state_path, frontier, interval, failed, max_gap, idle_cycles)
+
+                print(f"💤 {interval / 60:.1f} 分钟后再次检查")
+                time.sleep(interval)
+
+        except KeyboardInterrupt:
+            self._save_watch_state(state_path, frontier, interval, failed, max_gap, idle_cycles)
+            print(f"\n⏹️  已停止，最高ID: {frontier}")
+
+    def _save_watch_state(self, state_path, frontier, interval, failed, max_gap, idle_cycles):
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'frontier': frontier, 'interval': interval,
+                       'max_gap': max_gap, 'idle_cycles': idle_cycles,
+                       'failed': {str(media_id): attempts for media_id, attempts in failed.items()},
+                       'updated': datetime.now().isoformat(timespec='seconds')}, f)
+        os.replace(tmp_path, state_path)
+
     def retry_failed(self, delay_range=(3, 8)):
         """重试失败的下载 - 随机延迟"""
         if not self.failed_list:
@@ -375,6 +1691,11 @@ class MediaDownloader:
         print(f"❌ 失败: {len(self.failed_list)}")
         print(f"📦 总计: {total}")
         print(f"⏱️  耗时: {elapsed_time / 60:.1f} 分钟")
+        p50 = self.latency.percentile(50)
+        if p50 is not None:
+            print(f"📶 页面耗时: p50 {p50:.2f}秒 / p95 {self.latency.percentile(95):.2f}秒")
+        if self.hedge:
+            print(f"🔀 对冲请求: {self.hedged_requests}/{self.page_requests}")
         print(f"{'=' * 60}\n")
 
     def save_report(self, filename="download_report.txt"):
@@ -402,10 +1723,121 @@ class MediaDownloader:
 
         print(f"📄 报告已保存: {filename}")
 
+    def close(self):
+        """关闭清单、归档文件和线程池"""
+        if self.manifest:
+            self.manifest.close()
+        if self.archive:
+            self.archive.close()
+        if self._hedge_executor:
+            self._hedge_executor.shutdown(wait=False)
+        if self._page_executor:
+            self._page_executor.shutdown(wait=False)
+
+
+def _positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("必须大于0")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="媒体批量下载")
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('coordinator', help="创建分片和全局请求预算")
+    p.add_argument('--db', default="shards.db")
+    p.add_argument('--start-id', type=int, required=True)
+    p.add_argument('--end-id', type=int, required=True)
+    p.add_argument('--chunk-size', type=int, default=100)
+    p.add_argument('--rpm', type=_positive_float, default=10, help="所有节点合计每分钟资源页面请求数")
+    p.add_argument('--media-rpm', type=_positive_float, default=600,
+                   help="所有节点合计每分钟媒体请求数（播放列表、HLS分片、文件下载）")
+
+    p = subparsers.add_parser('worker', help="领取分片并下载")
+    p.add_argument('--db', default="shards.db")
+    p.add_argument('--worker-id')
+    p.add_argument('--lease', type=int, default=300, help="租约秒数")
+    p.add_argument('--max-attempts', type=int, default=3, help="分片最多领取次数，超过后标记失败")
+    p.add_argument('--manifest-dir', default="shards")
+    p.add_argument('--archive', help="页面归档文件，如 pages.gz")
+    p.add_argument('--hedge', action='store_true', help="页面超过p95时发送对冲请求")
+
+    p = subparsers.add_parser('merge', help="合并已完成分片的清单")
+    p.add_argument('--db', default="shards.db")
+    p.add_argument('--output', default="download_manifest.jsonl")
+
+    p = subparsers.add_parser('reextract', help="用当前提取器重跑页面归档")
+    p.add_argument('archive')
+    p.add_argument('--output', default="reextract.jsonl")
+    p.add_argument('--workers', type=int)
+
+    p = subparsers.add_parser('rebuild-index', help="扫描页面归档重建 .idx 索引")
+    p.add_argument('archive')
+
+    p = subparsers.add_parser('scan', help="快速校验已下载的MP4")
+    p.add_argument('root', nargs='?', default=".")
+
+    p = subparsers.add_parser('watch', help="持续监视并下载新发布的ID")
+    p.add_argument('--state', default="watch_state.json")
+    p.add_argument('--start-id', type=int, help="首次运行时已知的最高ID")
+    p.add_argument('--min-interval', type=float, default=60)
+    p.add_argument('--max-interval', type=float, default=3600)
+    p.add_argument('--gap', type=int, default=3, help="连续多少个空ID视为到头")
+    p.add_argument('--manifest', default="download_manifest.jsonl")
+
+    p = subparsers.add_parser('summary', help="统计清单")
+    p.add_argument('manifest', nargs='?', default="download_manifest.jsonl")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'coordinator':
+        coordinator = LeaseCoordinator(args.db)
+        progress = coordinator.create_shards(args.start_id, args.end_id, args.chunk_size,
+                                             args.rpm, args.media_rpm)
+        print(f"📦 分片状态: {progress}")
+
+    elif args.command == 'worker':
+        downloader = MediaDownloader(archive_path=args.archive, hedge=args.hedge)
+        coordinator = LeaseCoordinator(args.db, lease_seconds=args.lease, max_attempts=args.max_attempts)
+        downloader.run_worker(coordinator, worker_id=args.worker_id, manifest_dir=args.manifest_dir)
+        downloader.close()
+
+    elif args.command == 'merge':
+        coordinator = LeaseCoordinator(args.db)
+        progress = coordinator.progress()
+        if progress.get('pending') or progress.get('leased'):
+            print(f"⚠️  仍有未完成分片: {progress}")
+        for start_id, end_id, attempts in coordinator.failed_shards():
+            print(f"❌ 失败分片: {start_id} → {end_id} (领取{attempts}次)")
+        merge_manifests(coordinator.manifests(), args.output)
+        print_manifest_summary(args.output)
+
+    elif args.command == 'reextract':
+        reextract_archive(args.archive, args.output, args.workers)
+
+    elif args.command == 'rebuild-index':
+        PageArchive(args.archive).rebuild_index()
+
+    elif args.command == 'scan':
+        scan_mp4_tree(args.root)
+
+    elif args.command == 'watch':
+        downloader = MediaDownloader(manifest_path=args.manifest)
+        downloader.watch(args.state, args.start_id, args.min_interval, args.max_interval, args.gap)
+        downloader.close()
+
+    elif args.command == 'summary':
+        print_manifest_summary(args.manifest)
+
+    else:
+        run_example()
+
 
 # 使用示例
-if __name__ == "__main__":
-    downloader = MediaDownloader()
+def run_example():
+    downloader = MediaDownloader(manifest_path="download_manifest.jsonl")
 
     # 批量下载 - 随机延迟3-10秒
     downloader.batch_download(
@@ -420,5 +1852,10 @@ if __name__ == "__main__":
         if input().lower() == 'y':
             downloader.retry_failed(delay_range=(3, 8))
 
-    # 保存报告
-    downloader.save_report()
+    # 清单已逐条写入，这里只做统计
+    downloader.close()
+    print_manifest_summary(downloader.manifest.path)
+
+
+if __name__ == "__main__":
+    main()